@@ -0,0 +1,125 @@
+"""Offline proposal regeneration through the Anthropic Message Batches API.
+
+Batches are billed at half the price of synchronous calls and don't count
+against the interactive rate limits, which makes them the right fit for
+re-scoring historical leads (e.g. from a nightly cron).
+"""
+
+import time
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
+
+from anthropic import AsyncAnthropic
+
+from .config import AgentConfig, get_config
+from .state import MVPProposal
+from .tools import determine_partnership_tier, proposal_request_params
+
+if TYPE_CHECKING:
+    from api.database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Seconds between batch status checks
+POLL_INTERVAL = 60
+
+# Seconds to wait for a batch to end before cancelling it; the API
+# expires batches that haven't ended after 24 hours
+MAX_WAIT = 24 * 60 * 60
+
+
+def _proposal_request(
+    custom_id: str,
+    state: Dict[str, Any],
+    config: AgentConfig
+) -> Dict[str, Any]:
+    """Build one batch request asking for an MVP proposal.
+    
+    Uses the same prompt and tool as ``generate_mvp_proposal``.
+    """
+    return {
+        "custom_id": custom_id,
+        "params": {
+            "model": config.llm_model,
+            "max_tokens": config.max_tokens,
+            **proposal_request_params(
+                state.get("business_info", {}),
+                state.get("identified_task") or ""
+            )
+        }
+    }
+
+
+async def batch_regenerate_proposals(
+    conversation_ids: List[str],
+    db: "DatabaseManager",
+    config: Optional[AgentConfig] = None
+) -> Dict[str, MVPProposal]:
+    """Regenerate MVP proposals for stored conversations in one batch.
+    
+    Each stored conversation's business context becomes one batch request.
+    Once the batch has ended, successful proposals are written back as
+    leads and returned keyed by conversation ID. If the batch hasn't ended
+    after ``MAX_WAIT`` seconds, it is cancelled and ``TimeoutError`` raised.
+    """
+    config = config or get_config()
+    
+    # Custom IDs are restricted to [a-zA-Z0-9_-], so map them back by index
+    requests = []
+    custom_ids = {}
+    states = {}
+    for i, conversation_id in enumerate(conversation_ids):
+        conversation = await db.get_conversation(conversation_id)
+        if not conversation:
+            continue
+        custom_id = f"conv-{i}"
+        custom_ids[custom_id] = conversation_id
+        states[conversation_id] = conversation.get("state") or {}
+        requests.append(_proposal_request(custom_id, states[conversation_id], config))
+    
+    if not requests:
+        return {}
+    
+    async with AsyncAnthropic(api_key=config.anthropic_api_key) as client:
+        batch = await client.messages.batches.create(requests=requests)
+        logger.info(f"Submitted proposal batch {batch.id} with {len(requests)} requests")
+        
+        deadline = time.monotonic() + MAX_WAIT
+        while batch.processing_status != "ended":
+            if time.monotonic() >= deadline:
+                await client.messages.batches.cancel(batch.id)
+                raise TimeoutError(f"Proposal batch {batch.id} didn't end within {MAX_WAIT}s")
+            await asyncio.sleep(POLL_INTERVAL)
+            batch = await client.messages.batches.retrieve(batch.id)
+        
+        proposals = {}
+        async for entry in await client.messages.batches.results(batch.id):
+            conversation_id = custom_ids[entry.custom_id]
+            if entry.result.type != "succeeded":
+                logger.warning(f"Proposal for {conversation_id} failed: {entry.result.type}")
+                continue
+            
+            tool_input = next(
+                (block.input for block in entry.result.message.content
+                 if block.type == "tool_use"),
+                None
+            )
+            try:
+                proposal = MVPProposal(**tool_input)
+            except Exception as e:
+                logger.warning(f"Invalid proposal for {conversation_id}: {e}")
+                continue
+            
+            business_info = states[conversation_id].get("business_info", {})
+            mvp_proposal = proposal.model_dump()
+            tier = await determine_partnership_tier(business_info, mvp_proposal)
+            
+            await db.create_lead(
+                conversation_id=conversation_id,
+                mvp_proposal=mvp_proposal,
+                partnership_tier=tier
+            )
+            proposals[conversation_id] = proposal
+    
+    return proposals
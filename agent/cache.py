@@ -0,0 +1,93 @@
+"""In-process LLM response cache for deterministic prompts."""
+
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+
+# Maximum number of cached responses
+LLM_CACHE_SIZE = 2048
+
+# Seconds a cached response stays valid
+LLM_CACHE_TTL = 3600
+
+
+class LLMCache(BaseCache):
+    """LRU cache of LLM generations with a TTL.
+    
+    LangChain passes the serialized prompt and an ``llm_string`` holding
+    the model, temperature and bound tools, so hashing both keys a response
+    by everything that determines it. Message ids are dropped from the
+    prompt first: LangGraph gives every message a fresh id, which would
+    otherwise keep equal prompts from different conversations apart. Only
+    meant for temperature 0, where the same prompt is expected to get the
+    same answer.
+    """
+    
+    def __init__(self, maxsize: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, RETURN_VAL_TYPE]]" = OrderedDict()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+    
+    @staticmethod
+    def _normalize(prompt: str) -> str:
+        """Drop message ids from a serialized prompt."""
+        try:
+            messages = orjson.loads(prompt)
+        except orjson.JSONDecodeError:
+            return prompt
+        
+        if not isinstance(messages, list):
+            return prompt
+        
+        for message in messages:
+            if isinstance(message, dict) and isinstance(message.get("kwargs"), dict):
+                message["kwargs"].pop("id", None)
+        
+        return orjson.dumps(messages).decode()
+    
+    @classmethod
+    def _key(cls, prompt: str, llm_string: str) -> str:
+        """Hash the normalized prompt and model settings into a cache key."""
+        return hashlib.sha256(
+            f"{llm_string}\x00{cls._normalize(prompt)}".encode()
+        ).hexdigest()
+    
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Return the cached generations, if any and not expired."""
+        key = self._key(prompt, llm_string)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.stats["misses"] += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+    
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Cache generations, evicting the least recently used entry."""
+        key = self._key(prompt, llm_string)
+        self._entries[key] = (time.monotonic() + self.ttl, return_val)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def clear(self, **kwargs: Any) -> None:
+        """Drop every cached response."""
+        self._entries.clear()
+    
+    # The cache never blocks, so skip the executor hop of the defaults
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        return self.lookup(prompt, llm_string)
+    
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self.update(prompt, llm_string, return_val)
+    
+    async def aclear(self, **kwargs: Any) -> None:
+        self.clear()
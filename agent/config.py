@@ -20,6 +20,7 @@ class AgentConfig(BaseSettings):
     # Database (optional for now)
     postgres_dsn: Optional[str] = Field(default=None, validation_alias="POSTGRES_DSN")
     redis_url: str = Field(default="redis://localhost:6379", validation_alias="REDIS_URL")
+    checkpoint_ttl_minutes: int = Field(default=1440, validation_alias="CHECKPOINT_TTL_MINUTES")
     
     # Business Settings
     calendly_url: str = Field(
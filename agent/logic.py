@@ -1,41 +1,92 @@
 """Core agent logic using LangGraph for conversation management."""
 
 import asyncio
-import json
 import logging
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, AsyncIterator
 from datetime import datetime, timezone
 
+import redis.asyncio as redis
 from langchain_anthropic import ChatAnthropic
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.redis.aio import AsyncRedisSaver
 from langgraph.prebuilt import create_react_agent
 
+from .cache import LLMCache
 from .state import ConversationState, BusinessInfo, MVPProposal
 from .prompts import SYSTEM_PROMPT, QUESTION_PROMPTS
 from .config import get_config
-from .tools import extract_business_info, generate_mvp_proposal, determine_partnership_tier
+from .tools import (
+    extract_business_info, extract_and_respond, generate_mvp_proposal,
+    determine_partnership_tier, cached_system_message
+)
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def _get_llm(
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    api_key: str
+) -> ChatAnthropic:
+    """Return the process-wide chat model for these settings.
+    
+    Agents with the same settings share one client, so its pooled
+    keep-alive connections to the Anthropic API are reused instead of
+    paying a fresh TCP/TLS handshake per agent. At temperature 0 responses
+    are deterministic, so identical prompts are answered from an LLMCache.
+    """
+    return ChatAnthropic(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        anthropic_api_key=api_key,
+        cache=LLMCache() if temperature == 0 else None
+    )
+
+
 class SalesDiscoveryAgent:
     """Sales discovery agent with LangGraph conversation management."""
     
     def __init__(self, config=None):
         self.config = config or get_config()
         
-        # Initialize LLM - using Anthropic
-        self.llm = ChatAnthropic(
-            model=self.config.llm_model,
-            temperature=self.config.llm_temperature,
-            max_tokens=self.config.max_tokens,
-            anthropic_api_key=self.config.anthropic_api_key
+        # Initialize LLM - using Anthropic, shared across agents
+        self.llm = _get_llm(
+            self.config.llm_model,
+            self.config.llm_temperature,
+            self.config.max_tokens,
+            self.config.anthropic_api_key
         )
         
-        # Initialize checkpointer for conversation persistence
-        self.checkpointer = InMemorySaver()
+        # System prompt as a prompt-cache breakpoint, shared by every call
+        self._system_message = cached_system_message(SYSTEM_PROMPT)
+        
+        # Memoized business info extractions, keyed by message content hash
+        self._biz_cache: OrderedDict = OrderedDict()
+        
+        # In-flight structured LLM calls, shared by identical concurrent prompts
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
+        # Initialize checkpointer for conversation persistence. Checkpoints
+        # live in Redis so any worker can serve any conversation; idle
+        # conversations expire after the configured TTL.
+        self.checkpointer = AsyncRedisSaver(
+            redis_url=self.config.redis_url,
+            ttl={
+                "default_ttl": self.config.checkpoint_ttl_minutes,
+                "refresh_on_read": True
+            }
+        )
+        self._checkpointer_ready = False
+        
+        # Per-conversation surface state (stage, calendly flag, last reply),
+        # so API reads don't deserialize the full checkpoint
+        self.redis = redis.from_url(self.config.redis_url, decode_responses=True)
         
         # Build the conversation graph
         self.graph = self._build_graph()
@@ -44,12 +95,11 @@ class SalesDiscoveryAgent:
         """Build the LangGraph conversation state machine."""
         graph = StateGraph(ConversationState)
         
-        # Add nodes for each conversation stage
+        # Add nodes for each conversation stage. Stages that always run
+        # back to back share a node, so each pair costs one checkpoint write.
         graph.add_node("understand", self._understand_business)
-        graph.add_node("identify", self._identify_mvp)
-        graph.add_node("scope", self._scope_mvp)
-        graph.add_node("propose", self._create_proposal)
-        graph.add_node("recommend", self._recommend_tier)
+        graph.add_node("discover", self._discover)
+        graph.add_node("close", self._close)
         graph.add_node("book", self._book_demo)
         
         # Define the flow
@@ -61,14 +111,12 @@ class SalesDiscoveryAgent:
             self._should_continue_understanding,
             {
                 "continue": "understand",
-                "next": "identify"
+                "next": "discover"
             }
         )
         
-        graph.add_edge("identify", "scope")
-        graph.add_edge("scope", "propose")
-        graph.add_edge("propose", "recommend")
-        graph.add_edge("recommend", "book")
+        graph.add_edge("discover", "close")
+        graph.add_edge("close", "book")
         graph.add_edge("book", END)
         
         return graph.compile(checkpointer=self.checkpointer)
@@ -77,26 +125,35 @@ class SalesDiscoveryAgent:
         """Understand the business through 2-3 questions."""
         questions_asked = state.get("questions_asked", 0)
         
+        # Once all questions are asked, identify refreshes the business
+        # info in the same call that writes its reply
+        if questions_asked >= len(QUESTION_PROMPTS["understand"]):
+            return {"stage": "identify"}
+        
+        update = {}
+        
         # Extract business info from the conversation so far
         if state["messages"]:
             business_info = await extract_business_info(
                 self.llm, 
-                state["messages"]
+                state["messages"],
+                state.get("business_info"),
+                cache=self._biz_cache,
+                inflight=self._inflight
             )
-            state["business_info"] = business_info.dict()
+            update["business_info"] = business_info.model_dump(exclude_defaults=True)
         
-        # Determine which question to ask
-        if questions_asked < len(QUESTION_PROMPTS["understand"]):
-            question = QUESTION_PROMPTS["understand"][questions_asked]
-            response = AIMessage(content=question)
-            
-            return {
-                "messages": [response],
-                "questions_asked": questions_asked + 1,
-                "stage": "understand"
-            }
+        # Ask the next question
+        question = QUESTION_PROMPTS["understand"][questions_asked]
+        response = AIMessage(content=question)
         
-        return {"stage": "identify"}
+        return {
+            **update,
+            "messages": [response],
+            "last_ai_message": question,
+            "questions_asked": questions_asked + 1,
+            "stage": "understand"
+        }
     
     def _should_continue_understanding(self, state: ConversationState) -> str:
         """Determine if we should continue understanding or move to identify."""
@@ -117,54 +174,77 @@ class SalesDiscoveryAgent:
             
         return "continue"
     
-    async def _identify_mvp(self, state: ConversationState) -> Dict[str, Any]:
-        """Identify the MVP opportunity."""
-        prompt = [
-            SystemMessage(content=SYSTEM_PROMPT),
-            *state["messages"],
-            HumanMessage(content=QUESTION_PROMPTS["identify"])
-        ]
+    async def _discover(self, state: ConversationState) -> Dict[str, Any]:
+        """Identify the MVP opportunity, then scope it."""
+        identified = await self._identify_mvp(state)
+        scoped = await self._scope_mvp(state)
         
-        response = await self.llm.ainvoke(prompt)
+        return {
+            **identified,
+            **scoped,
+            "messages": identified["messages"] + scoped["messages"]
+        }
+    
+    async def _close(self, state: ConversationState) -> Dict[str, Any]:
+        """Create the MVP proposal, then recommend a partnership tier."""
+        proposed = await self._create_proposal(state)
+        recommended = await self._recommend_tier({**state, **proposed})
         
         return {
-            "messages": [AIMessage(content=response.content)],
+            **proposed,
+            **recommended,
+            "messages": proposed["messages"] + recommended["messages"]
+        }
+    
+    async def _identify_mvp(self, state: ConversationState) -> Dict[str, Any]:
+        """Identify the MVP opportunity."""
+        business_info, reply = await extract_and_respond(
+            self.llm,
+            state["messages"],
+            "identify",
+            self._system_message,
+            state.get("business_info")
+        )
+        
+        update = {
+            "messages": [AIMessage(content=reply)],
+            "last_ai_message": reply,
             "stage": "identify"
         }
+        if business_info is not None:
+            update["business_info"] = business_info.model_dump(exclude_defaults=True)
+        
+        return update
     
     async def _scope_mvp(self, state: ConversationState) -> Dict[str, Any]:
         """Get specific details about the MVP."""
-        # Extract the identified task from previous messages
-        last_human_msg = None
-        for msg in reversed(state["messages"]):
-            if isinstance(msg, HumanMessage):
-                last_human_msg = msg.content
-                break
-        
-        identified_task = last_human_msg or "the process you mentioned"
+        # The identified task is their latest answer
+        identified_task = state.get("last_human_message") or "the process you mentioned"
         
         # Ask scoping questions
-        scope_questions = QUESTION_PROMPTS["scope"]
-        formatted_questions = [
-            q.format(task=identified_task) for q in scope_questions
-        ]
-        
-        question = "\n".join(formatted_questions)
+        question = QUESTION_PROMPTS["scope"].format(task=identified_task)
         
         return {
             "messages": [AIMessage(content=question)],
+            "last_ai_message": question,
             "identified_task": identified_task,
             "stage": "scope"
         }
     
     async def _create_proposal(self, state: ConversationState) -> Dict[str, Any]:
         """Create the MVP proposal."""
+        business_info = state.get("business_info", {})
+        
+        # The tier only depends on business info, so determine it up front
+        tier = await determine_partnership_tier(business_info, {})
+        
         # Generate the proposal based on all collected information
         proposal = await generate_mvp_proposal(
             self.llm,
             state["messages"],
-            state.get("business_info", {}),
-            state.get("identified_task", "")
+            business_info,
+            state.get("identified_task", ""),
+            inflight=self._inflight
         )
         
         # Format the proposal
@@ -181,13 +261,16 @@ class SalesDiscoveryAgent:
         
         return {
             "messages": [AIMessage(content=formatted_proposal)],
-            "mvp_proposal": proposal.dict(),
+            "last_ai_message": formatted_proposal,
+            "mvp_proposal": proposal.model_dump(),
+            "partnership_tier": tier,
             "stage": "propose"
         }
     
     async def _recommend_tier(self, state: ConversationState) -> Dict[str, Any]:
         """Recommend partnership tier."""
-        tier = await determine_partnership_tier(
+        # Normally already determined together with the proposal
+        tier = state.get("partnership_tier") or await determine_partnership_tier(
             state.get("business_info", {}),
             state.get("mvp_proposal", {})
         )
@@ -208,6 +291,7 @@ Ready to see this in action?
         
         return {
             "messages": [AIMessage(content=recommendation)],
+            "last_ai_message": recommendation,
             "partnership_tier": tier,
             "stage": "recommend"
         }
@@ -220,26 +304,85 @@ Ready to see this in action?
         
         return {
             "messages": [AIMessage(content=calendly_prompt)],
+            "last_ai_message": calendly_prompt,
             "calendly_shown": True,
             "stage": "complete"
         }
     
-    async def process_message(
-        self, 
-        conversation_id: str,
+    async def setup(self):
+        """Prepare external resources ahead of the first message."""
+        await self._setup_checkpointer()
+    
+    async def close(self):
+        """Close the agent's Redis clients."""
+        await self.redis.aclose()
+        await self.checkpointer.__aexit__(None, None, None)
+    
+    async def _setup_checkpointer(self):
+        """Create the checkpointer's Redis indices on first use."""
+        if not self._checkpointer_ready:
+            await self.checkpointer.asetup()
+            self._checkpointer_ready = True
+    
+    @staticmethod
+    def _surface_key(conversation_id: str) -> str:
+        """Redis key of a conversation's surface state hash."""
+        return f"conversation:{conversation_id}:surface"
+    
+    async def _save_surface(self, conversation_id: str, surface: Dict[str, Any]) -> int:
+        """Write the surface state and return the turn count, expiring with the checkpoints."""
+        key = self._surface_key(conversation_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping=surface)
+            pipe.hincrby(key, "turns", 1)
+            pipe.expire(key, self.config.checkpoint_ttl_minutes * 60)
+            _, turns, _ = await pipe.execute()
+        
+        return turns
+    
+    @staticmethod
+    def _surface(state_values: Dict[str, Any]) -> Dict[str, Any]:
+        """Pick the surface state out of the state after a turn."""
+        return {
+            "stage": state_values.get("stage") or "",
+            "calendly_shown": int(bool(state_values.get("calendly_shown", False))),
+            "last_ai_content": state_values.get("last_ai_message") or ""
+        }
+    
+    async def get_surface_state(self, conversation_id: str) -> Dict[str, Any]:
+        """Get a conversation's stage, calendly flag, last reply and turn count."""
+        surface = await self.redis.hgetall(self._surface_key(conversation_id))
+        if not surface:
+            return {}
+        
+        return {
+            "stage": surface.get("stage") or None,
+            "calendly_shown": surface.get("calendly_shown") == "1",
+            "last_ai_content": surface.get("last_ai_content") or None,
+            "turns": int(surface.get("turns") or 0)
+        }
+    
+    async def _graph_input(
+        self,
+        config: Dict[str, Any],
         message: str,
-        source: str = "api"
+        source: str
     ) -> Dict[str, Any]:
-        """Process a message in the conversation."""
-        config = {"configurable": {"thread_id": conversation_id}}
-        
-        # Get current state or initialize
-        current_state = self.graph.get_state(config)
-        
-        if not current_state.values:
+        """Build the graph input for the next turn of a conversation."""
+        # A surface state means the conversation exists; only fall back to
+        # loading the checkpoint when there is none
+        conversation_id = config["configurable"]["thread_id"]
+        exists = await self.redis.exists(self._surface_key(conversation_id))
+        if not exists:
+            current_state = await self.graph.aget_state(config)
+            exists = bool(current_state.values)
+        
+        if not exists:
             # Initialize new conversation
-            initial_state = {
+            return {
                 "messages": [],
+                "last_human_message": None,
+                "last_ai_message": None,
                 "conversation_id": conversation_id,
                 "source": source,
                 "stage": "start",
@@ -248,29 +391,66 @@ Ready to see this in action?
                 "started_at": datetime.now(timezone.utc),
                 "calendly_shown": False
             }
-            await self.graph.ainvoke(initial_state, config)
-        else:
-            # Add user message and continue
-            user_message = HumanMessage(content=message)
-            await self.graph.ainvoke(
-                {"messages": [user_message]},
-                config
-            )
         
-        # Get the updated state
-        updated_state = self.graph.get_state(config)
-        state_values = updated_state.values if updated_state.values else {}
+        # Add user message and continue
+        return {
+            "messages": [HumanMessage(content=message)],
+            "last_human_message": message
+        }
+    
+    async def process_message(
+        self, 
+        conversation_id: str,
+        message: str,
+        source: str = "api"
+    ) -> Dict[str, Any]:
+        """Process a message in the conversation."""
+        config = {"configurable": {"thread_id": conversation_id}}
+        await self._setup_checkpointer()
+        
+        graph_input = await self._graph_input(config, message, source)
         
-        # Get the last AI message as response
-        last_ai_message = None
-        for msg in reversed(state_values.get("messages", [])):
-            if isinstance(msg, AIMessage):
-                last_ai_message = msg.content
-                break
+        # ainvoke returns the updated state, so there's no need to load it
+        state_values = await self.graph.ainvoke(graph_input, config) or {}
+        
+        turn = await self._save_surface(conversation_id, self._surface(state_values))
         
         return {
-            "response": last_ai_message,
+            "response": state_values.get("last_ai_message"),
             "stage": state_values.get("stage"),
             "conversation_id": conversation_id,
-            "calendly_shown": state_values.get("calendly_shown", False)
-        }
\ No newline at end of file
+            "calendly_shown": state_values.get("calendly_shown", False),
+            "turn": turn
+        }
+    
+    async def stream_message(
+        self,
+        conversation_id: str,
+        message: str,
+        source: str = "api"
+    ) -> AsyncIterator[str]:
+        """Process a message, yielding each AI message as soon as its node finishes.
+        
+        Structured LLM calls are tagged ``nostream``, so only the messages
+        the nodes add to the conversation are streamed. The state values are
+        streamed too, so the surface state is saved from the final ones.
+        """
+        config = {"configurable": {"thread_id": conversation_id}}
+        await self._setup_checkpointer()
+        
+        graph_input = await self._graph_input(config, message, source)
+        state_values = {}
+        async for mode, data in self.graph.astream(
+            graph_input,
+            config,
+            stream_mode=["messages", "values"]
+        ):
+            if mode == "values":
+                state_values = data
+                continue
+            
+            chunk, _ = data
+            if isinstance(chunk, AIMessage) and chunk.content:
+                yield chunk.content
+        
+        await self._save_surface(conversation_id, self._surface(state_values))
@@ -21,6 +21,33 @@ You must format the proposal like this:
 * Focus on QUICK WINS for the first agent.
 * End the conversation by driving them to the Calendly link."""
 
+EXTRACTION_PROMPT = """You are given what is already known about a business and the latest messages of a conversation with them.
+Update the business information with anything new from the messages.
+Return a JSON object with these fields:
+- business_type: what kind of business they run
+- team_size: number of employees (null if not mentioned)
+- biggest_challenge: their main operational challenge
+- time_wasters: list of tasks that waste time
+- current_tools: list of tools/software they use"""
+
+PROPOSAL_PROMPT = """Create an MVP AI agent proposal for the business context you are given. Return a JSON object with:
+- agent_name: catchy name for the agent
+- description: specific description of what it does (2-3 sentences)
+- time_saved: realistic time saved per week
+- integrations: list of tools it integrates with
+- success_metric: measurable outcome
+- delivery_time: realistic delivery timeframe
+
+Make it specific and achievable. Focus on quick wins."""
+
+RESPOND_PROMPT = """{instruction}
+
+What is already known about their business: {business_info}
+
+Return a JSON object with these fields:
+- business_info: what you know about their business so far, with the fields business_type, team_size (null if not mentioned), biggest_challenge, time_wasters (list) and current_tools (list)
+- reply: your next message to them"""
+
 QUESTION_PROMPTS = {
     "understand": [
         "What does your business do and what's your biggest operational challenge?",
@@ -28,10 +55,10 @@ QUESTION_PROMPTS = {
         "What manual process frustrates you the most?"
     ],
     "identify": "Based on what you've told me, which single task would save you the most time if automated?",
-    "scope": [
-        "Walk me through the current process for {task}. What are the inputs and outputs?",
-        "What tools or systems does this process interact with?",
+    "scope": (
+        "Walk me through the current process for {task}. What are the inputs and outputs?\n"
+        "What tools or systems does this process interact with?\n"
         "How do you measure success for this task currently?"
-    ],
+    ),
     "calendly": "Perfect! The next step is to book a 30-minute demo where I'll show you exactly how this will work: {calendly_url}"
 }
\ No newline at end of file
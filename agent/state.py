@@ -17,6 +17,12 @@ class BusinessInfo(BaseModel):
     current_tools: List[str] = []
 
 
+class DiscoveryReply(BaseModel):
+    """Business information extracted alongside the next reply."""
+    business_info: BusinessInfo
+    reply: str
+
+
 class MVPProposal(BaseModel):
     """MVP agent proposal."""
     agent_name: str
@@ -31,6 +37,8 @@ class ConversationState(TypedDict):
     """State for the sales discovery conversation."""
     # Message history
     messages: Annotated[List[BaseMessage], add_messages]
+    last_human_message: Optional[str]
+    last_ai_message: Optional[str]
     
     # Conversation metadata
     conversation_id: str
@@ -1,94 +1,313 @@
 """Tools and utilities for the Sales Discovery Bot."""
 
 import re
-from typing import List, Dict, Any, Optional
-from langchain_core.messages import BaseMessage
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+import orjson
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from langchain_anthropic import ChatAnthropic
+from langchain_anthropic.chat_models import convert_to_anthropic_tool
+from langgraph.constants import TAG_NOSTREAM
+
+from .state import BusinessInfo, DiscoveryReply, MVPProposal
+from .prompts import EXTRACTION_PROMPT, PROPOSAL_PROMPT, RESPOND_PROMPT, QUESTION_PROMPTS
+
+# Maximum number of memoized extractions kept per cache
+BUSINESS_INFO_CACHE_SIZE = 1024
+
+# Number of recent messages sent alongside the known business info;
+# older turns are already summarized in that info
+HISTORY_WINDOW = 4
+
+# Answers up to this many words are tried against the regexes below
+# before falling back to the LLM
+QUICK_EXTRACT_MAX_WORDS = 50
+
+TEAM_RE = re.compile(r'\b(\d{1,4})[ -]?(?:people|employees|person|staff|team)\b', re.I)
+TOOLS_RE = re.compile(
+    r'\b(Slack|HubSpot|Salesforce|Gmail|Notion|Zapier|Airtable|Stripe|Shopify)\b',
+    re.I
+)
+
+# Body of the first markdown code block, with or without a json tag
+CODE_BLOCK_RE = re.compile(r'```(?:json)?(.*?)(?:```|\Z)', re.S)
+
+
+def cached_system_message(text: str) -> SystemMessage:
+    """Build a system message marked as an Anthropic prompt-cache breakpoint.
+    
+    Reusing the returned message keeps the prompt prefix byte-identical
+    across calls, so everything up to it is read from the cache.
+    """
+    return SystemMessage(content=[
+        {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+    ])
+
+
+_EXTRACTION_SYSTEM = cached_system_message(EXTRACTION_PROMPT)
+_PROPOSAL_SYSTEM = cached_system_message(PROPOSAL_PROMPT)
+
+# Structured calls produce JSON, not user-facing text, so keep them out
+# of the graph's message stream
+_NOSTREAM_CONFIG = {"tags": [TAG_NOSTREAM]}
+
+# Tool schemas forcing Anthropic to answer with schema-valid JSON
+_BUSINESS_INFO_TOOL = convert_to_anthropic_tool(BusinessInfo)
+_DISCOVERY_REPLY_TOOL = convert_to_anthropic_tool(DiscoveryReply)
+_MVP_PROPOSAL_TOOL = convert_to_anthropic_tool(MVPProposal)
+
+
+async def _invoke_structured(
+    llm: ChatAnthropic,
+    prompt: List[BaseMessage],
+    tool: Dict[str, Any],
+    inflight: Optional[Dict[str, "asyncio.Future"]] = None
+) -> Dict[str, Any]:
+    """Invoke the LLM forced to call ``tool`` and return the call arguments.
+    
+    If an ``inflight`` registry is given, concurrent calls with an identical
+    prompt share one LLM request instead of each issuing their own.
+    """
+    if inflight is None:
+        return await _call_structured(llm, prompt, tool)
+    
+    key = hashlib.sha256(
+        "|".join([tool["name"], *(str(m.content) for m in prompt)]).encode()
+    ).hexdigest()
+    
+    future = inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_call_structured(llm, prompt, tool))
+        inflight[key] = future
+        future.add_done_callback(lambda _: inflight.pop(key, None))
+    
+    # Shield so one caller being cancelled doesn't cancel the shared call
+    return await asyncio.shield(future)
+
 
-from .state import BusinessInfo, MVPProposal
+async def _call_structured(
+    llm: ChatAnthropic,
+    prompt: List[BaseMessage],
+    tool: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Make the forced tool call for ``_invoke_structured``.
+    
+    Falls back to parsing JSON from the text content when the response
+    carries no tool call.
+    """
+    response = await llm.ainvoke(
+        prompt,
+        config=_NOSTREAM_CONFIG,
+        tools=[tool],
+        tool_choice={"type": "tool", "name": tool["name"]}
+    )
+    
+    tool_calls = getattr(response, "tool_calls", None)
+    if isinstance(tool_calls, list):
+        for call in tool_calls:
+            if call["name"] == tool["name"]:
+                return call["args"]
+    
+    return _parse_json(response.content)
+
+
+def _parse_json(content: str) -> Dict[str, Any]:
+    """Parse a JSON object from an LLM response (handles markdown code blocks)."""
+    match = CODE_BLOCK_RE.search(content)
+    json_str = match.group(1) if match else content
+    
+    return orjson.loads(json_str.strip())
+
+
+def _dumps_sorted(data: Dict[str, Any]) -> str:
+    """Serialize to JSON with sorted keys, so equal dicts give equal text."""
+    return orjson.dumps(data, option=orjson.OPT_SORT_KEYS).decode()
+
+
+def _quick_extract(
+    text: str,
+    business_info: Optional[Dict[str, Any]] = None
+) -> Optional[BusinessInfo]:
+    """Extract team size and tools from a short answer without the LLM.
+    
+    Returns ``None`` unless the answer is short and both a team size and
+    at least one tool are found; the result is merged into the known info.
+    The known info was validated when it was extracted and the regexes only
+    yield ints and strings, so the model is built without re-validating.
+    """
+    if len(text.split()) >= QUICK_EXTRACT_MAX_WORDS:
+        return None
+    
+    team = TEAM_RE.search(text)
+    tools = TOOLS_RE.findall(text)
+    if not team or not tools:
+        return None
+    
+    known = business_info or {}
+    current_tools = list(known.get("current_tools", []))
+    for tool in tools:
+        if tool.lower() not in (t.lower() for t in current_tools):
+            current_tools.append(tool)
+    
+    return BusinessInfo.model_construct(**{
+        **known,
+        "team_size": int(team.group(1)),
+        "current_tools": current_tools
+    })
+
+
+def _messages_hash(messages: List[BaseMessage], known: str = "") -> str:
+    """Hash the known facts and message contents to key memoized extractions."""
+    return hashlib.sha256(
+        "|".join([known, *(m.content for m in messages)]).encode()
+    ).hexdigest()
 
 
 async def extract_business_info(
     llm: ChatAnthropic,
-    messages: List[BaseMessage]
+    messages: List[BaseMessage],
+    business_info: Optional[Dict[str, Any]] = None,
+    cache: Optional["OrderedDict[str, BusinessInfo]"] = None,
+    inflight: Optional[Dict[str, "asyncio.Future"]] = None
 ) -> BusinessInfo:
-    """Extract business information from conversation history."""
+    """Extract business information from conversation history.
+    
+    Only the last ``HISTORY_WINDOW`` messages are sent, together with the
+    business info known so far, so the prompt size doesn't grow with the
+    conversation. If a cache is given, results are memoized by content so
+    an unchanged input is never sent to the LLM twice. Short answers that
+    the regex fast path fully covers skip the LLM altogether.
+    """
+    latest = next((m for m in reversed(messages) if m.type == "human"), None)
+    if latest is not None and isinstance(latest.content, str):
+        quick = _quick_extract(latest.content, business_info)
+        if quick is not None:
+            return quick
+    
+    recent = messages[-HISTORY_WINDOW:]
+    known = _dumps_sorted(business_info or {})
+    
+    cache_key = None
+    if cache is not None:
+        cache_key = _messages_hash(recent, known)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            cache.move_to_end(cache_key)
+            return cached
     
-    # Create a prompt to extract structured information
-    extraction_prompt = f"""
-Analyze the following conversation and extract business information.
-Return a JSON object with these fields:
-- business_type: what kind of business they run
-- team_size: number of employees (null if not mentioned)
-- biggest_challenge: their main operational challenge
-- time_wasters: list of tasks that waste time
-- current_tools: list of tools/software they use
+    # Static instructions go first (cached), the conversation follows
+    extraction_prompt = [
+        _EXTRACTION_SYSTEM,
+        HumanMessage(content=f"""Known business info:
+{known}
 
-Conversation:
-{chr(10).join([f'{m.type}: {m.content}' for m in messages])}
+Latest messages:
+{chr(10).join([f'{m.type}: {m.content}' for m in recent])}
 
-JSON:
-"""
+JSON:""")
+    ]
     
-    response = await llm.ainvoke(extraction_prompt)
-    
-    # Parse JSON from response
     try:
-        import json
-        # Extract JSON from response (handle markdown code blocks)
-        json_str = response.content
-        if "```json" in json_str:
-            json_str = json_str.split("```json")[1].split("```")[0]
-        elif "```" in json_str:
-            json_str = json_str.split("```")[1].split("```")[0]
-            
-        data = json.loads(json_str.strip())
-        return BusinessInfo(**data)
+        business_info = BusinessInfo(**await _invoke_structured(
+            llm, extraction_prompt, _BUSINESS_INFO_TOOL, inflight
+        ))
     except:
         # Return empty if parsing fails
         return BusinessInfo()
+    
+    if cache is not None:
+        cache[cache_key] = business_info
+        if len(cache) > BUSINESS_INFO_CACHE_SIZE:
+            cache.popitem(last=False)
+    
+    return business_info
 
 
-async def generate_mvp_proposal(
+async def extract_and_respond(
     llm: ChatAnthropic,
     messages: List[BaseMessage],
-    business_info: Dict[str, Any],
-    identified_task: str
-) -> MVPProposal:
-    """Generate an MVP proposal based on the conversation."""
+    stage: str,
+    system_message: SystemMessage,
+    business_info: Optional[Dict[str, Any]] = None
+) -> Tuple[Optional[BusinessInfo], str]:
+    """Extract business information and write the next reply in one call.
     
-    proposal_prompt = f"""
-Based on this business context:
+    Like ``extract_business_info``, only the known business info and the
+    last ``HISTORY_WINDOW`` messages are sent. Returns ``None`` for the
+    business info when the tool call fails; the stage's question is then
+    used as the reply.
+    """
+    prompt = [
+        system_message,
+        *messages[-HISTORY_WINDOW:],
+        HumanMessage(content=RESPOND_PROMPT.format(
+            instruction=QUESTION_PROMPTS[stage],
+            business_info=_dumps_sorted(business_info or {})
+        ))
+    ]
+    
+    try:
+        result = DiscoveryReply(**await _invoke_structured(
+            llm, prompt, _DISCOVERY_REPLY_TOOL
+        ))
+        return result.business_info, result.reply
+    except:
+        # Never show the user a malformed response
+        return None, QUESTION_PROMPTS[stage]
+
+
+def proposal_context(business_info: Dict[str, Any], identified_task: str) -> str:
+    """Build the business context message a proposal is generated from."""
+    return f"""Business context:
 - Type: {business_info.get('business_type')}
 - Challenge: {business_info.get('biggest_challenge')}
 - Task to automate: {identified_task}
 - Current tools: {business_info.get('current_tools', [])}
 
-Create an MVP AI agent proposal. Return a JSON object with:
-- agent_name: catchy name for the agent
-- description: specific description of what it does (2-3 sentences)
-- time_saved: realistic time saved per week
-- integrations: list of tools it integrates with
-- success_metric: measurable outcome
-- delivery_time: realistic delivery timeframe
+JSON:"""
+
+
+def proposal_request_params(
+    business_info: Dict[str, Any],
+    identified_task: str
+) -> Dict[str, Any]:
+    """Build Anthropic Messages API params for the forced proposal tool call.
+    
+    For callers of the SDK itself, such as the Batches API; the prompt is
+    the one ``generate_mvp_proposal`` sends.
+    """
+    return {
+        "system": _PROPOSAL_SYSTEM.content,
+        "messages": [{
+            "role": "user",
+            "content": proposal_context(business_info, identified_task)
+        }],
+        "tools": [_MVP_PROPOSAL_TOOL],
+        "tool_choice": {"type": "tool", "name": _MVP_PROPOSAL_TOOL["name"]}
+    }
 
-Make it specific and achievable. Focus on quick wins.
 
-JSON:
-"""
+async def generate_mvp_proposal(
+    llm: ChatAnthropic,
+    messages: List[BaseMessage],
+    business_info: Dict[str, Any],
+    identified_task: str,
+    inflight: Optional[Dict[str, "asyncio.Future"]] = None
+) -> MVPProposal:
+    """Generate an MVP proposal based on the conversation."""
     
-    response = await llm.ainvoke(proposal_prompt)
+    proposal_prompt = [
+        _PROPOSAL_SYSTEM,
+        HumanMessage(content=proposal_context(business_info, identified_task))
+    ]
     
     try:
-        import json
-        json_str = response.content
-        if "```json" in json_str:
-            json_str = json_str.split("```json")[1].split("```")[0]
-        elif "```" in json_str:
-            json_str = json_str.split("```")[1].split("```")[0]
-            
-        data = json.loads(json_str.strip())
-        return MVPProposal(**data)
+        return MVPProposal(**await _invoke_structured(
+            llm, proposal_prompt, _MVP_PROPOSAL_TOOL, inflight
+        ))
     except:
         # Fallback proposal
         return MVPProposal(
@@ -0,0 +1,65 @@
+"""Redis response cache for the chat endpoint."""
+
+import hashlib
+from typing import Optional
+
+import msgspec
+import redis.asyncio as redis
+
+from .models import ChatResponse
+
+
+class ResponseCache:
+    """Caches a conversation's latest chat response for client retries.
+    
+    Responses are keyed by the turn they completed and the message, so
+    only a resend right after that turn hits; any later turn changes the
+    key. Each conversation's responses live in one hash, which ``set``
+    replaces, so older turns never linger.
+    """
+    
+    def __init__(self, client: redis.Redis, ttl: int = 300):
+        self.client = client
+        self.ttl = ttl
+    
+    @staticmethod
+    def _key(conversation_id: str) -> str:
+        """Build the key of a conversation's response hash."""
+        return f"chat:conv:{conversation_id}:resp"
+    
+    @staticmethod
+    def _field(turn: int, message: str) -> str:
+        """Build the hash field for a normalized message at a turn."""
+        return hashlib.sha256(
+            f"{turn}:{message.lower().strip()}".encode()
+        ).hexdigest()
+    
+    async def get(
+        self,
+        conversation_id: str,
+        turn: int,
+        message: str
+    ) -> Optional[ChatResponse]:
+        """Get the response cached for this message at the latest turn, if any."""
+        cached = await self.client.hget(
+            self._key(conversation_id), self._field(turn, message)
+        )
+        if cached is None:
+            return None
+        
+        return msgspec.json.decode(cached, type=ChatResponse)
+    
+    async def set(
+        self,
+        conversation_id: str,
+        turn: int,
+        message: str,
+        response: ChatResponse
+    ):
+        """Cache the response of a turn, replacing those of earlier turns."""
+        key = self._key(conversation_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.unlink(key)
+            pipe.hset(key, self._field(turn, message), msgspec.json.encode(response))
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
@@ -1,13 +1,115 @@
 """Database management for Sales Discovery Bot."""
 
-import json
+import time
 import uuid
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple
 
 import asyncpg
+import orjson
 from asyncpg.pool import Pool
 
+# Seconds the conversation count estimate is reused
+COUNT_ESTIMATE_TTL = 60
+
+# Advisory lock key serializing migrations across server workers
+MIGRATIONS_LOCK_ID = 7_311_002
+
+# Seconds a migration statement (or waiting for the lock) may take; index
+# builds outlast the pool's command timeout
+MIGRATIONS_TIMEOUT = 600
+
+# Schema statements, all idempotent; run in order when their checksum
+# isn't recorded in schema_migrations yet
+MIGRATIONS = [
+    # Create conversations table
+    """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            conversation_id VARCHAR(255) UNIQUE NOT NULL,
+            source VARCHAR(50) NOT NULL,
+            state JSONB DEFAULT '{}',
+            metadata JSONB DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    
+    # Create messages table
+    """
+        CREATE TABLE IF NOT EXISTS messages (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            conversation_id VARCHAR(255) REFERENCES conversations(conversation_id),
+            role VARCHAR(10) NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    
+    # Create leads table
+    """
+        CREATE TABLE IF NOT EXISTS leads (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            conversation_id VARCHAR(255) REFERENCES conversations(conversation_id),
+            business_name VARCHAR(255),
+            contact_email VARCHAR(255),
+            proposed_mvp JSONB,
+            partnership_tier VARCHAR(20),
+            calendly_booked BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    
+    # Create indexes
+    """
+        CREATE INDEX IF NOT EXISTS idx_conversations_created 
+        ON conversations(created_at DESC)
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation 
+        ON messages(conversation_id, created_at)
+    """,
+    
+    # One lead per conversation, so lead upserts can target conversation_id;
+    # keep only the newest of any duplicates before enforcing it
+    """
+        DELETE FROM leads a
+        USING leads b
+        WHERE a.conversation_id = b.conversation_id
+        AND (a.created_at, a.id) < (b.created_at, b.id)
+    """,
+    """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_conversation_unique
+        ON leads(conversation_id)
+    """,
+    """
+        DROP INDEX IF EXISTS idx_leads_conversation
+    """,
+    
+    # Keyset pagination indexes for listing conversations
+    """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_updated
+        ON conversations(updated_at DESC, conversation_id DESC)
+    """,
+    """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_source_updated
+        ON conversations(source, updated_at DESC, conversation_id DESC)
+    """,
+]
+
+MIGRATIONS_CHECKSUM = hashlib.sha256("\n".join(MIGRATIONS).encode()).hexdigest()
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Decode and encode JSONB columns with orjson on every pool connection."""
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=lambda value: orjson.dumps(value).decode(),
+        decoder=orjson.loads,
+        schema="pg_catalog"
+    )
+
 
 class DatabaseManager:
     """Handles all database operations."""
@@ -15,14 +117,24 @@ class DatabaseManager:
     def __init__(self, dsn: str):
         self.dsn = dsn
         self.pool: Optional[Pool] = None
+        self._count_estimates: Dict[Optional[str], Tuple[float, int]] = {}
     
     async def initialize(self):
         """Initialize database connection pool."""
         self.pool = await asyncpg.create_pool(
             self.dsn,
-            min_size=5,
-            max_size=20,
-            command_timeout=60
+            min_size=10,
+            max_size=50,
+            max_inactive_connection_lifetime=300,
+            # Recycle connections periodically to bound per-connection memory
+            max_queries=50_000,
+            # asyncpg prepares and caches statements per connection, keyed
+            # by query text; keep every hot query's plan resident for the
+            # connection's lifetime
+            statement_cache_size=1024,
+            max_cached_statement_lifetime=0,
+            command_timeout=30,
+            init=_init_connection
         )
     
     async def close(self):
@@ -36,74 +148,69 @@ class DatabaseManager:
             result = await conn.fetchval("SELECT 1")
             return result == 1
     
+    @staticmethod
+    async def _migrations_applied(conn: asyncpg.Connection) -> bool:
+        """Check whether the current migrations' checksum is recorded."""
+        if not await conn.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL"):
+            return False
+        
+        return await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT 1 FROM schema_migrations WHERE checksum = $1
+            )
+        """, MIGRATIONS_CHECKSUM)
+    
+    async def needs_migrations(self) -> bool:
+        """Check whether the current migrations have not been applied yet."""
+        async with self.pool.acquire() as conn:
+            return not await self._migrations_applied(conn)
+    
     async def run_migrations(self):
-        """Run database migrations."""
+        """Run database migrations and record their checksum.
+        
+        Every server worker may call this on startup, so migrations run
+        under an advisory lock and are skipped if another process applied
+        them while this one waited.
+        """
         async with self.pool.acquire() as conn:
-            # Create conversations table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    conversation_id VARCHAR(255) UNIQUE NOT NULL,
-                    source VARCHAR(50) NOT NULL,
-                    state JSONB DEFAULT '{}',
-                    metadata JSONB DEFAULT '{}',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Create messages table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    conversation_id VARCHAR(255) REFERENCES conversations(conversation_id),
-                    role VARCHAR(10) NOT NULL,
-                    content TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Create leads table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS leads (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    conversation_id VARCHAR(255) REFERENCES conversations(conversation_id),
-                    business_name VARCHAR(255),
-                    contact_email VARCHAR(255),
-                    proposed_mvp JSONB,
-                    partnership_tier VARCHAR(20),
-                    calendly_booked BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Create indexes
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_conversations_created 
-                ON conversations(created_at DESC)
-            """)
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_messages_conversation 
-                ON messages(conversation_id, created_at)
-            """)
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_leads_conversation 
-                ON leads(conversation_id)
-            """)
+            await conn.execute(
+                "SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID,
+                timeout=MIGRATIONS_TIMEOUT
+            )
+            try:
+                if await self._migrations_applied(conn):
+                    return
+                
+                for migration in MIGRATIONS:
+                    await conn.execute(migration, timeout=MIGRATIONS_TIMEOUT)
+                
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        checksum VARCHAR(64) PRIMARY KEY,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                await conn.execute("""
+                    INSERT INTO schema_migrations (checksum) VALUES ($1)
+                    ON CONFLICT (checksum) DO NOTHING
+                """, MIGRATIONS_CHECKSUM)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
     
     async def create_conversation(
         self,
         conversation_id: str,
         source: str
     ) -> Dict[str, Any]:
-        """Create a new conversation."""
+        """Create a new conversation; returns None if it already exists."""
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow("""
                 INSERT INTO conversations (conversation_id, source)
                 VALUES ($1, $2)
+                ON CONFLICT (conversation_id) DO NOTHING
                 RETURNING *
             """, conversation_id, source)
-            return dict(row)
+            return dict(row) if row else None
     
     async def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
         """Get conversation by ID."""
@@ -114,18 +221,45 @@ class DatabaseManager:
             """, conversation_id)
             return dict(row) if row else None
     
+    async def get_conversation_updated_at(self, conversation_id: str) -> Optional[datetime]:
+        """Get when a conversation was last updated."""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval("""
+                SELECT updated_at FROM conversations
+                WHERE conversation_id = $1
+            """, conversation_id)
+    
+    async def get_conversation_with_messages(
+        self,
+        conversation_id: str
+    ) -> Optional[Dict[str, Any]]:
+        """Get a conversation and its messages (oldest first) in one query."""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT
+                    c.*,
+                    COALESCE((
+                        SELECT jsonb_agg(m ORDER BY m.created_at)
+                        FROM messages m
+                        WHERE m.conversation_id = c.conversation_id
+                    ), '[]'::jsonb) as messages
+                FROM conversations c
+                WHERE c.conversation_id = $1
+            """, conversation_id)
+            return dict(row) if row else None
+    
     async def update_conversation_state(
         self,
         conversation_id: str,
         state: Dict[str, Any]
     ):
-        """Update conversation state."""
+        """Merge changed state keys into the conversation's state."""
         async with self.pool.acquire() as conn:
             await conn.execute("""
                 UPDATE conversations
-                SET state = $2, updated_at = CURRENT_TIMESTAMP
+                SET state = state || $2, updated_at = CURRENT_TIMESTAMP
                 WHERE conversation_id = $1
-            """, conversation_id, json.dumps(state))
+            """, conversation_id, state)
     
     async def add_message(
         self,
@@ -142,6 +276,111 @@ class DatabaseManager:
             """, conversation_id, role, content)
             return dict(row)
     
+    async def add_messages_bulk(
+        self,
+        rows: List[Tuple[str, str, str]]
+    ):
+        """Add several (conversation_id, role, content) messages in one COPY."""
+        async with self.pool.acquire() as conn:
+            await self._copy_messages(conn, rows)
+    
+    @staticmethod
+    async def _copy_messages(
+        conn: asyncpg.Connection,
+        rows: List[Tuple[str, str, str]]
+    ):
+        """COPY (conversation_id, role, content) messages on a connection.
+        
+        Rows are timestamped a microsecond apart so they keep their order
+        when read back by created_at. The base time comes from the server,
+        in the same local time as the CURRENT_TIMESTAMP defaults.
+        """
+        now = await conn.fetchval("SELECT clock_timestamp()::timestamp")
+        records = [
+            (conversation_id, role, content, now + timedelta(microseconds=i))
+            for i, (conversation_id, role, content) in enumerate(rows)
+        ]
+        
+        await conn.copy_records_to_table(
+            "messages",
+            records=records,
+            columns=["conversation_id", "role", "content", "created_at"]
+        )
+    
+    async def commit_chat_turn(
+        self,
+        conversation_id: str,
+        source: str,
+        human_message: str,
+        ai_message: str,
+        state: Dict[str, Any],
+        lead: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Persist one chat turn in a single transaction.
+        
+        Creates the conversation if needed and merges ``state`` (the changed
+        keys only) into its stored state, copies the human and AI messages,
+        and, if ``lead`` (``mvp_proposal`` and ``partnership_tier``) is
+        given, upserts the lead. Returns whether the conversation was
+        created by this turn.
+        """
+        upsert_conversation = """
+            INSERT INTO conversations (conversation_id, source, state)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (conversation_id) DO UPDATE
+            SET
+                state = conversations.state || EXCLUDED.state,
+                updated_at = CURRENT_TIMESTAMP
+        """
+        
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if lead is None:
+                    # xmax is only zero for freshly inserted rows
+                    created = await conn.fetchval(
+                        upsert_conversation + "RETURNING xmax = 0",
+                        conversation_id, source, state
+                    )
+                else:
+                    # Upsert the lead in the same statement; the business
+                    # name comes from the merged state the upsert returns
+                    created = await conn.fetchval(f"""
+                        WITH conv AS (
+                            {upsert_conversation}
+                            RETURNING conversation_id, state, xmax = 0 AS created
+                        )
+                        INSERT INTO leads (
+                            conversation_id,
+                            business_name,
+                            proposed_mvp,
+                            partnership_tier
+                        )
+                        SELECT
+                            conversation_id,
+                            COALESCE(state->'business_info'->>'business_type', 'Unknown'),
+                            $4,
+                            $5
+                        FROM conv
+                        ON CONFLICT (conversation_id) DO UPDATE
+                        SET 
+                            proposed_mvp = EXCLUDED.proposed_mvp,
+                            partnership_tier = EXCLUDED.partnership_tier
+                        RETURNING (SELECT created FROM conv)
+                    """,
+                        conversation_id,
+                        source,
+                        state,
+                        lead.get("mvp_proposal"),
+                        lead.get("partnership_tier")
+                    )
+                
+                await self._copy_messages(conn, [
+                    (conversation_id, "human", human_message),
+                    (conversation_id, "ai", ai_message)
+                ])
+        
+        return bool(created)
+    
     async def get_messages(
         self,
         conversation_id: str
@@ -158,15 +397,22 @@ class DatabaseManager:
     async def list_conversations(
         self,
         limit: int = 50,
-        offset: int = 0,
+        after: Optional[Tuple[datetime, str]] = None,
         source: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        """List conversations with summaries."""
+        """List conversations with summaries, most recently updated first.
+        
+        Pages by keyset: pass the ``(updated_at, conversation_id)`` of the
+        last row of the previous page as ``after`` to get the next one.
+        """
         async with self.pool.acquire() as conn:
             query = """
                 SELECT 
                     c.*,
-                    COUNT(m.id) as message_count,
+                    (
+                        SELECT COUNT(*) FROM messages m
+                        WHERE m.conversation_id = c.conversation_id
+                    ) as message_count,
                     COALESCE(c.state->>'stage', 'unknown') as stage,
                     COALESCE(c.state->>'calendly_shown', 'false')::boolean as calendly_shown,
                     CASE 
@@ -174,26 +420,62 @@ class DatabaseManager:
                         THEN true ELSE false 
                     END as has_proposal
                 FROM conversations c
-                LEFT JOIN messages m ON c.conversation_id = m.conversation_id
             """
             
+            conditions = []
             params = []
             if source:
-                query += " WHERE c.source = $1"
                 params.append(source)
+                conditions.append("c.source = $%d" % len(params))
+            if after:
+                params.extend(after)
+                conditions.append(
+                    "(c.updated_at, c.conversation_id) < ($%d, $%d)"
+                    % (len(params) - 1, len(params))
+                )
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
             
+            params.append(limit)
             query += """
-                GROUP BY c.id, c.conversation_id, c.source, c.state, c.metadata, 
-                         c.created_at, c.updated_at
-                ORDER BY c.created_at DESC
-                LIMIT $%d OFFSET $%d
-            """ % (len(params) + 1, len(params) + 2)
-            
-            params.extend([limit, offset])
+                ORDER BY c.updated_at DESC, c.conversation_id DESC
+                LIMIT $%d
+            """ % len(params)
             
             rows = await conn.fetch(query, *params)
             return [dict(row) for row in rows]
     
+    async def estimate_conversation_count(self, source: Optional[str] = None) -> int:
+        """Estimate the number of conversations, optionally from one source.
+        
+        Avoids a full COUNT(*) scan: the total comes from the table's
+        planner statistics, a source's count from the planner's row estimate
+        for that filter. Both are refreshed by (auto)vacuum and analyze and
+        cached for a minute.
+        """
+        now = time.monotonic()
+        cached = self._count_estimates.get(source)
+        if cached and now - cached[0] < COUNT_ESTIMATE_TTL:
+            return cached[1]
+        
+        async with self.pool.acquire() as conn:
+            if source is None:
+                estimate = await conn.fetchval("""
+                    SELECT reltuples::bigint FROM pg_class
+                    WHERE oid = 'conversations'::regclass
+                """)
+            else:
+                plan = await conn.fetchval("""
+                    EXPLAIN (FORMAT JSON)
+                    SELECT 1 FROM conversations WHERE source = $1::text
+                """, source)
+                estimate = int(orjson.loads(plan)[0]["Plan"]["Plan Rows"])
+        
+        # Never-analyzed tables report -1
+        estimate = max(estimate or 0, 0)
+        self._count_estimates[source] = (now, estimate)
+        return estimate
+    
     async def create_lead(
         self,
         conversation_id: str,
@@ -207,8 +489,7 @@ class DatabaseManager:
             if not conv:
                 raise ValueError(f"Conversation {conversation_id} not found")
             
-            state = json.loads(conv["state"]) if isinstance(conv["state"], str) else conv["state"]
-            business_info = state.get("business_info", {})
+            business_info = conv["state"].get("business_info", {})
             
             row = await conn.fetchrow("""
                 INSERT INTO leads (
@@ -225,7 +506,7 @@ class DatabaseManager:
             """, 
                 conversation_id,
                 business_info.get("business_type", "Unknown"),
-                json.dumps(mvp_proposal) if mvp_proposal else None,
+                mvp_proposal,
                 partnership_tier
             )
             return dict(row)
\ No newline at end of file
@@ -1,161 +1,308 @@
 """FastAPI application for Sales Discovery Bot."""
 
 import os
-import uuid
-import json
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import re
+import base64
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Tuple, Callable, Awaitable
 
-from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from fastapi.responses import FileResponse, ORJSONResponse
+from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from prometheus_client import Counter, Histogram, generate_latest
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest
+)
 import asyncpg
+import msgspec
 import redis.asyncio as redis
+from uuid6 import uuid7
 
 from agent import SalesDiscoveryAgent, AgentConfig
+from .cache import ResponseCache
 from .database import DatabaseManager
 from .models import (
     ChatRequest, ChatResponse, ConversationResponse,
     ConversationListResponse
 )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize services on startup and clean them up on shutdown."""
+    global agent, db, redis_client, response_cache
+    
+    # Initialize configuration
+    config = AgentConfig()
+    
+    # Initialize agent, database and Redis
+    agent = SalesDiscoveryAgent(config)
+    db = DatabaseManager(config.postgres_dsn)
+    redis_client = redis.from_url(config.redis_url)
+    response_cache = ResponseCache(redis_client)
+    
+    # Open the pool and prepare the checkpointer concurrently
+    await asyncio.gather(db.initialize(), agent.setup())
+    db_pool_size.set_function(db.pool.get_size)
+    db_pool_idle.set_function(db.pool.get_idle_size)
+    
+    # Run migrations only when the schema has changed
+    if await db.needs_migrations():
+        await db.run_migrations()
+    
+    yield
+    
+    # Cleanup on shutdown
+    await db.close()
+    await redis_client.close()
+    await agent.close()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Sales Discovery Bot API",
     description="AI-powered sales discovery agent for Insta Agents",
-    version="1.0.0"
+    version="1.0.0",
+    # Serialize JSON responses with orjson instead of the stdlib encoder
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-# Add CORS middleware for web embedding
+
+class ScopedCORSMiddleware:
+    """Apply CORS only to requests under the given path prefixes.
+    
+    Probes, metrics and the widget assets skip the CORS handling entirely.
+    """
+    
+    def __init__(self, app: ASGIApp, paths: Tuple[str, ...], **options):
+        self.app = app
+        self.paths = paths
+        self.cors = CORSMiddleware(app, **options)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["path"].startswith(self.paths):
+            await self.cors(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+# Add CORS middleware for cross-origin API clients. The widget page calls
+# the API from its own origin; sites embedding the widget must be listed
+# in CORS_ALLOWED_ORIGINS (comma separated). No other origin is allowed.
+CORS_ALLOWED_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ALLOWED_ORIGINS", "").split(",")
+    if origin.strip()
+]
+
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately for production
+    ScopedCORSMiddleware,
+    paths=("/chat", "/conversation"),
+    allow_origins=CORS_ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type"],
 )
 
-# Metrics
+# Metrics live in their own registry, so scrapes skip the default
+# registry's process and platform collectors
+REGISTRY = CollectorRegistry()
+
 conversations_started = Counter(
     "conversations_started_total",
-    "Total conversations initiated"
+    "Total conversations initiated",
+    registry=REGISTRY
 )
 conversations_completed = Counter(
     "conversations_completed_total",
-    "Conversations reaching proposal stage"
+    "Conversations reaching proposal stage",
+    registry=REGISTRY
 )
 demos_booked = Counter(
     "demos_booked_total",
-    "Successful Calendly redirects"
+    "Successful Calendly redirects",
+    registry=REGISTRY
 )
 response_time = Histogram(
     "response_time_seconds",
-    "Time to generate response"
+    "Time to generate response",
+    registry=REGISTRY
+)
+cache_hits = Counter(
+    "cache_hits_total",
+    "Chat responses served from the response cache",
+    registry=REGISTRY
+)
+cache_misses = Counter(
+    "cache_misses_total",
+    "Chat responses that had to be generated",
+    registry=REGISTRY
+)
+db_pool_size = Gauge(
+    "db_pool_size",
+    "Open connections in the database pool",
+    registry=REGISTRY
+)
+db_pool_idle = Gauge(
+    "db_pool_idle_size",
+    "Idle connections in the database pool",
+    registry=REGISTRY
 )
 
 # Global instances
 agent: Optional[SalesDiscoveryAgent] = None
 db: Optional[DatabaseManager] = None
 redis_client: Optional[redis.Redis] = None
+response_cache: Optional[ResponseCache] = None
 
+# Seconds a healthy /health result is reused for repeated probes
+HEALTH_CACHE_TTL = 1.0
+_last_healthy: Optional[Tuple[float, Dict[str, Any]]] = None
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup."""
-    global agent, db, redis_client
-    
-    # Initialize configuration
-    config = AgentConfig()
-    
-    # Initialize agent
-    agent = SalesDiscoveryAgent(config)
-    
-    # Initialize database
-    db = DatabaseManager(config.postgres_dsn)
-    await db.initialize()
-    
-    # Initialize Redis
-    redis_client = redis.from_url(config.redis_url)
-    
-    # Run migrations
-    await db.run_migrations()
+# Seconds a rendered /metrics payload is reused
+METRICS_CACHE_TTL = 1.0
+_cached_metrics: Optional[Tuple[float, bytes]] = None
+_metrics_lock = asyncio.Lock()
 
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown."""
-    if db:
-        await db.close()
-    if redis_client:
-        await redis_client.close()
+async def _probe(check: Optional[Callable[[], Awaitable[Any]]]) -> bool:
+    """Run one health probe, reporting failure instead of raising."""
+    if check is None:
+        return False
+    
+    try:
+        await check()
+        return True
+    except:
+        return False
 
 
 @app.get("/health")
 async def health():
     """Health check endpoint."""
+    global _last_healthy
+    
+    # Load balancer probes within the TTL reuse the last healthy result
+    now = time.monotonic()
+    if _last_healthy and now - _last_healthy[0] < HEALTH_CACHE_TTL:
+        return _last_healthy[1]
+    
+    # Check database and Redis concurrently
+    database_ok, redis_ok = await asyncio.gather(
+        _probe(db.health_check if db else None),
+        _probe(redis_client.ping if redis_client else None)
+    )
+    
     checks = {
         "api": "healthy",
         "agent": agent is not None,
-        "database": False,
-        "redis": False
+        "database": database_ok,
+        "redis": redis_ok
     }
     
-    # Check database
-    try:
-        if db:
-            await db.health_check()
-            checks["database"] = True
-    except:
-        pass
-    
-    # Check Redis
-    try:
-        if redis_client:
-            await redis_client.ping()
-            checks["redis"] = True
-    except:
-        pass
-    
     status = "healthy" if all(checks.values()) else "unhealthy"
     
-    return {
+    result = {
         "status": status,
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
         "version": "1.0.0",
         "checks": checks
     }
+    
+    _last_healthy = (now, result) if status == "healthy" else None
+    
+    return result
 
 
 @app.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint."""
+    global _cached_metrics
+    
+    # Concurrent scrapes within the TTL share one rendering
+    async with _metrics_lock:
+        now = time.monotonic()
+        if not _cached_metrics or now - _cached_metrics[0] >= METRICS_CACHE_TTL:
+            _cached_metrics = (now, generate_latest(REGISTRY))
+    
     return Response(
-        content=generate_latest(),
-        media_type="text/plain"
+        content=_cached_metrics[1],
+        media_type=CONTENT_TYPE_LATEST
     )
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+_CALENDLY_RE = re.compile(r"https://calendly\.com/[^\s)]+")
+
+
+def _state_delta(result: Dict[str, Any], surface: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only the state keys that changed since the previous turn."""
+    previous = {
+        "conversation_id": result.get("conversation_id"),
+        "response": surface.get("last_ai_content"),
+        "stage": surface.get("stage"),
+        "calendly_shown": surface.get("calendly_shown")
+    } if surface else {}
+    
+    return {
+        key: value for key, value in result.items()
+        if key not in previous or previous[key] != value
+    }
+
+
+async def _chat_request(request: Request) -> ChatRequest:
+    """Decode and validate the /chat body with msgspec."""
+    try:
+        return msgspec.json.decode(await request.body(), type=ChatRequest)
+    except msgspec.ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _chat_response(response: ChatResponse) -> Response:
+    """Encode a /chat response with msgspec."""
+    return Response(
+        content=msgspec.json.encode(response),
+        media_type="application/json"
+    )
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest = Depends(_chat_request)):
     """Process a chat message."""
     if not agent:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
     with response_time.time():
-        # Generate conversation ID if not provided
-        conversation_id = request.conversation_id or str(uuid.uuid4())
+        # Generate conversation ID if not provided; UUIDv7 IDs are time
+        # ordered, so new rows land at the right edge of the indexes
+        conversation_id = request.conversation_id or str(uuid7())
         
-        # Track new conversations
         is_new = request.conversation_id is None
-        if is_new:
-            conversations_started.inc()
-            # Store conversation metadata
-            await db.create_conversation(
-                conversation_id=conversation_id,
-                source=request.source
+        
+        # The surface state is what the previous turn stored
+        surface = {}
+        if not is_new:
+            surface = await agent.get_surface_state(conversation_id)
+        
+        # A resend of the message that completed the latest turn is a client
+        # retry; that turn is already in the history, so serve its response
+        if not is_new and response_cache:
+            cached = await response_cache.get(
+                conversation_id, surface.get("turns", 0), request.message
             )
+            if cached:
+                cache_hits.inc()
+                return _chat_response(cached)
+            cache_misses.inc()
         
         # Process message
         result = await agent.process_message(
@@ -164,373 +311,182 @@ async def chat(request: ChatRequest):
             source=request.source
         )
         
-        # Store message in database
-        await db.add_message(
-            conversation_id=conversation_id,
-            role="human",
-            content=request.message
-        )
-        await db.add_message(
-            conversation_id=conversation_id,
-            role="ai",
-            content=result["response"]
-        )
-        
-        # Update conversation state
-        await db.update_conversation_state(
-            conversation_id=conversation_id,
-            state=result
-        )
+        # The turn count only keys the cache; it isn't conversation state
+        turn = result.pop("turn")
         
         # Track completions
+        lead = None
         if result.get("stage") == "propose":
             conversations_completed.inc()
         elif result.get("calendly_shown"):
             demos_booked.inc()
             # Create lead record
-            await db.create_lead(
-                conversation_id=conversation_id,
-                mvp_proposal=result.get("mvp_proposal"),
-                partnership_tier=result.get("partnership_tier")
-            )
+            lead = {
+                "mvp_proposal": result.get("mvp_proposal"),
+                "partnership_tier": result.get("partnership_tier")
+            }
         
-        return ChatResponse(
+        # Store the conversation, both messages, the changed state and any
+        # lead in one transaction
+        created = await db.commit_chat_turn(
+            conversation_id=conversation_id,
+            source=request.source,
+            human_message=request.message,
+            ai_message=result["response"],
+            state=_state_delta(result, surface),
+            lead=lead
+        )
+        
+        # Track new conversations; the upsert tells whether the row is new,
+        # even when the client supplied its own ID
+        if created:
+            conversations_started.inc()
+        
+        # Hand the widget the booking link instead of it searching the reply
+        calendly_url = None
+        if result.get("calendly_shown"):
+            match = _CALENDLY_RE.search(result["response"] or "")
+            calendly_url = match.group(0) if match else None
+        
+        response = ChatResponse(
             conversation_id=conversation_id,
             response=result["response"],
             stage=result.get("stage"),
-            calendly_shown=result.get("calendly_shown", False)
+            calendly_shown=result.get("calendly_shown", False),
+            calendly_url=calendly_url
         )
+        
+        if not is_new and response_cache:
+            await response_cache.set(conversation_id, turn, request.message, response)
+        
+        return _chat_response(response)
+
+
+def _conversation_etag(updated_at: datetime) -> str:
+    """ETag of a conversation, derived from its last update time."""
+    return f'"{int(updated_at.timestamp() * 1_000_000):x}"'
 
 
 @app.get("/conversation/{conversation_id}", response_model=ConversationResponse)
-async def get_conversation(conversation_id: str):
+async def get_conversation(conversation_id: str, request: Request, response: Response):
     """Get conversation history."""
     if not db:
         raise HTTPException(status_code=503, detail="Database not initialized")
     
-    conversation = await db.get_conversation(conversation_id)
+    headers = {"Cache-Control": "private, must-revalidate"}
+    
+    # Revalidating polls only need the update time to answer 304
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        updated_at = await db.get_conversation_updated_at(conversation_id)
+        if updated_at and _conversation_etag(updated_at) == if_none_match:
+            headers["ETag"] = if_none_match
+            return Response(status_code=304, headers=headers)
+    
+    conversation = await db.get_conversation_with_messages(conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    messages = await db.get_messages(conversation_id)
+    headers["ETag"] = _conversation_etag(conversation["updated_at"])
+    response.headers.update(headers)
     
     return ConversationResponse(
         conversation_id=conversation_id,
-        messages=messages,
+        messages=conversation["messages"],
         state=conversation.get("state", {}),
         created_at=conversation["created_at"],
         updated_at=conversation["updated_at"]
     )
 
 
+def _encode_cursor(updated_at: datetime, conversation_id: str) -> str:
+    """Encode a conversation's sort key as an opaque page cursor."""
+    return base64.urlsafe_b64encode(
+        f"{updated_at.isoformat()}|{conversation_id}".encode()
+    ).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a page cursor back into ``(updated_at, conversation_id)``."""
+    try:
+        updated_at, _, conversation_id = base64.urlsafe_b64decode(
+            cursor.encode()
+        ).decode().partition("|")
+        return datetime.fromisoformat(updated_at), conversation_id
+    except:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/conversations", response_model=ConversationListResponse)
 async def list_conversations(
     limit: int = Query(default=50, le=100),
-    offset: int = Query(default=0, ge=0),
+    cursor: Optional[str] = None,
     source: Optional[str] = None
 ):
     """List all conversations (admin endpoint)."""
     if not db:
         raise HTTPException(status_code=503, detail="Database not initialized")
     
-    conversations = await db.list_conversations(
-        limit=limit,
-        offset=offset,
-        source=source
+    after = _decode_cursor(cursor) if cursor else None
+    conversations, total = await asyncio.gather(
+        db.list_conversations(
+            limit=limit,
+            after=after,
+            source=source
+        ),
+        db.estimate_conversation_count(source)
     )
     
+    # A full page may have more after it
+    next_cursor = None
+    if len(conversations) == limit:
+        last = conversations[-1]
+        next_cursor = _encode_cursor(last["updated_at"], last["conversation_id"])
+    
     return ConversationListResponse(
         conversations=conversations,
-        total=len(conversations),
+        total=total,
         limit=limit,
-        offset=offset
+        next_cursor=next_cursor
     )
 
 
+def _file_response(request: Request, path: Path, stat: os.stat_result, media_type: str) -> Response:
+    """Serve a static file via sendfile, answering revalidations with 304."""
+    response = FileResponse(
+        path,
+        media_type=media_type,
+        stat_result=stat,
+        headers={"Cache-Control": "public, max-age=86400"}
+    )
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if response.headers["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={
+            "ETag": response.headers["etag"],
+            "Cache-Control": response.headers["cache-control"]
+        })
+    
+    return response
+
+
+# Static files never change while the app runs, so stat them once
+STATIC_DIR = Path(__file__).parent / "static"
+_WIDGET_JS = STATIC_DIR / "widget.js"
+_WIDGET_JS_STAT = os.stat(_WIDGET_JS)
+_WIDGET_HTML = STATIC_DIR / "widget.html"
+_WIDGET_HTML_STAT = os.stat(_WIDGET_HTML)
+
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+
+
 @app.get("/widget.js")
-async def widget_script():
+async def widget_script(request: Request):
     """Serve the embeddable widget script."""
-    widget_js = """
-(function() {
-    window.InstaAgentsChat = {
-        init: function(config) {
-            const defaults = {
-                position: 'bottom-right',
-                theme: 'light',
-                apiUrl: window.location.origin
-            };
-            const settings = Object.assign({}, defaults, config);
-            
-            // Create chat widget iframe
-            const iframe = document.createElement('iframe');
-            iframe.id = 'insta-agents-chat';
-            iframe.src = settings.apiUrl + '/widget';
-            iframe.style.cssText = `
-                position: fixed;
-                ${settings.position.includes('bottom') ? 'bottom: 20px' : 'top: 20px'};
-                ${settings.position.includes('right') ? 'right: 20px' : 'left: 20px'};
-                width: 400px;
-                height: 600px;
-                border: none;
-                border-radius: 10px;
-                box-shadow: 0 0 20px rgba(0,0,0,0.1);
-                z-index: 9999;
-                display: none;
-            `;
-            
-            // Create toggle button
-            const button = document.createElement('button');
-            button.id = 'insta-agents-toggle';
-            button.innerHTML = '💬';
-            button.style.cssText = `
-                position: fixed;
-                ${settings.position.includes('bottom') ? 'bottom: 20px' : 'top: 20px'};
-                ${settings.position.includes('right') ? 'right: 20px' : 'left: 20px'};
-                width: 60px;
-                height: 60px;
-                border-radius: 50%;
-                background: #2563eb;
-                color: white;
-                border: none;
-                font-size: 24px;
-                cursor: pointer;
-                box-shadow: 0 4px 12px rgba(0,0,0,0.15);
-                z-index: 9998;
-            `;
-            
-            button.onclick = function() {
-                const isVisible = iframe.style.display === 'block';
-                iframe.style.display = isVisible ? 'none' : 'block';
-                button.style.display = isVisible ? 'block' : 'none';
-            };
-            
-            // Add to page
-            document.body.appendChild(iframe);
-            document.body.appendChild(button);
-            
-            // Message passing
-            window.addEventListener('message', function(event) {
-                if (event.data.type === 'insta-agents-resize') {
-                    iframe.style.height = event.data.height + 'px';
-                }
-            });
-        }
-    };
-})();
-"""
-    return Response(content=widget_js, media_type="application/javascript")
+    return _file_response(request, _WIDGET_JS, _WIDGET_JS_STAT, "application/javascript")
 
 
 @app.get("/widget")
-async def widget_html():
+async def widget_html(request: Request):
     """Serve the widget HTML interface."""
-    html = """
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Insta Agents Chat</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; }
-        
-        .chat-container {
-            height: 100vh;
-            display: flex;
-            flex-direction: column;
-            background: #f9fafb;
-        }
-        
-        .chat-header {
-            background: #2563eb;
-            color: white;
-            padding: 1rem;
-            font-weight: 600;
-        }
-        
-        .chat-messages {
-            flex: 1;
-            overflow-y: auto;
-            padding: 1rem;
-        }
-        
-        .message {
-            margin-bottom: 1rem;
-            display: flex;
-            gap: 0.5rem;
-        }
-        
-        .message.ai { justify-content: flex-start; }
-        .message.human { justify-content: flex-end; }
-        
-        .message-bubble {
-            max-width: 80%;
-            padding: 0.75rem 1rem;
-            border-radius: 1rem;
-        }
-        
-        .message.ai .message-bubble {
-            background: white;
-            border: 1px solid #e5e7eb;
-        }
-        
-        .message.human .message-bubble {
-            background: #2563eb;
-            color: white;
-        }
-        
-        .chat-input {
-            padding: 1rem;
-            background: white;
-            border-top: 1px solid #e5e7eb;
-        }
-        
-        .input-group {
-            display: flex;
-            gap: 0.5rem;
-        }
-        
-        input {
-            flex: 1;
-            padding: 0.75rem;
-            border: 1px solid #e5e7eb;
-            border-radius: 0.5rem;
-            font-size: 1rem;
-        }
-        
-        button {
-            padding: 0.75rem 1.5rem;
-            background: #2563eb;
-            color: white;
-            border: none;
-            border-radius: 0.5rem;
-            font-weight: 500;
-            cursor: pointer;
-        }
-        
-        button:hover { background: #1d4ed8; }
-        button:disabled { background: #9ca3af; cursor: not-allowed; }
-    </style>
-</head>
-<body>
-    <div class="chat-container">
-        <div class="chat-header">
-            🤖 Insta Agents - AI Partnership Discovery
-        </div>
-        
-        <div class="chat-messages" id="messages">
-            <div class="message ai">
-                <div class="message-bubble">
-                    Hi! I'm here to help you discover how AI can transform your business. 
-                    Let's start with a quick question - what does your business do?
-                </div>
-            </div>
-        </div>
-        
-        <div class="chat-input">
-            <form id="chat-form" class="input-group">
-                <input 
-                    type="text" 
-                    id="message-input" 
-                    placeholder="Type your message..."
-                    autocomplete="off"
-                    required
-                />
-                <button type="submit" id="send-button">Send</button>
-            </form>
-        </div>
-    </div>
-    
-    <script>
-        const messagesEl = document.getElementById('messages');
-        const formEl = document.getElementById('chat-form');
-        const inputEl = document.getElementById('message-input');
-        const buttonEl = document.getElementById('send-button');
-        
-        let conversationId = localStorage.getItem('insta-agents-conversation-id');
-        
-        function addMessage(content, role) {
-            const messageEl = document.createElement('div');
-            messageEl.className = `message ${role}`;
-            
-            const bubbleEl = document.createElement('div');
-            bubbleEl.className = 'message-bubble';
-            bubbleEl.textContent = content;
-            
-            messageEl.appendChild(bubbleEl);
-            messagesEl.appendChild(messageEl);
-            messagesEl.scrollTop = messagesEl.scrollHeight;
-        }
-        
-        async function sendMessage(message) {
-            // Disable form
-            inputEl.disabled = true;
-            buttonEl.disabled = true;
-            
-            // Add user message
-            addMessage(message, 'human');
-            
-            try {
-                const response = await fetch('/chat', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        conversation_id: conversationId,
-                        message: message,
-                        source: 'widget'
-                    })
-                });
-                
-                const data = await response.json();
-                
-                // Store conversation ID
-                if (!conversationId) {
-                    conversationId = data.conversation_id;
-                    localStorage.setItem('insta-agents-conversation-id', conversationId);
-                }
-                
-                // Add AI response
-                addMessage(data.response, 'ai');
-                
-                // Check if Calendly link shown
-                if (data.calendly_shown && data.response.includes('calendly.com')) {
-                    setTimeout(() => {
-                        if (confirm('Ready to book your demo?')) {
-                            window.open(data.response.match(/https:\/\/calendly\.com[^\s]+/)[0], '_blank');
-                        }
-                    }, 1000);
-                }
-                
-            } catch (error) {
-                addMessage('Sorry, I encountered an error. Please try again.', 'ai');
-            } finally {
-                // Re-enable form
-                inputEl.disabled = false;
-                buttonEl.disabled = false;
-                inputEl.value = '';
-                inputEl.focus();
-            }
-        }
-        
-        formEl.addEventListener('submit', async (e) => {
-            e.preventDefault();
-            const message = inputEl.value.trim();
-            if (message) {
-                await sendMessage(message);
-            }
-        });
-        
-        // Focus input on load
-        inputEl.focus();
-        
-        // Notify parent of size
-        window.parent.postMessage({
-            type: 'insta-agents-resize',
-            height: document.body.scrollHeight
-        }, '*');
-    </script>
-</body>
-</html>
-"""
-    return HTMLResponse(content=html)
\ No newline at end of file
+    return _file_response(request, _WIDGET_HTML, _WIDGET_HTML_STAT, "text/html")
\ No newline at end of file
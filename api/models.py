@@ -1,29 +1,33 @@
-"""Pydantic models for API requests/responses."""
+"""Models for API requests/responses."""
 
 from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
+
+import msgspec
 from pydantic import BaseModel, Field
 
 
-class ChatRequest(BaseModel):
-    """Chat endpoint request model."""
-    conversation_id: Optional[str] = Field(
-        None,
-        description="Existing conversation ID or None to start new"
-    )
-    message: str = Field(..., description="User message")
-    source: Literal["widget", "email", "api"] = Field(
-        default="api",
-        description="Source of the conversation"
-    )
+class ChatRequest(msgspec.Struct, frozen=True):
+    """Chat endpoint request model.
+    
+    /chat is the hot path, so its models are msgspec structs, which
+    decode and encode much faster than Pydantic models.
+    """
+    # User message
+    message: str
+    # Existing conversation ID or None to start new
+    conversation_id: Optional[str] = None
+    # Source of the conversation
+    source: Literal["widget", "email", "api"] = "api"
 
 
-class ChatResponse(BaseModel):
+class ChatResponse(msgspec.Struct):
     """Chat endpoint response model."""
     conversation_id: str
     response: str
     stage: Optional[str] = None
     calendly_shown: bool = False
+    calendly_url: Optional[str] = None
 
 
 class Message(BaseModel):
@@ -58,6 +62,12 @@ class ConversationSummary(BaseModel):
 class ConversationListResponse(BaseModel):
     """Conversation list response."""
     conversations: List[ConversationSummary]
-    total: int
+    total: int = Field(
+        ...,
+        description="Estimated number of conversations, from the source if filtered"
+    )
     limit: int
-    offset: int
\ No newline at end of file
+    next_cursor: Optional[str] = Field(
+        None,
+        description="Cursor for the next page, or None on the last page"
+    )
\ No newline at end of file
@@ -0,0 +1,66 @@
+(function() {
+    window.InstaAgentsChat = {
+        init: function(config) {
+            const defaults = {
+                position: 'bottom-right',
+                theme: 'light',
+                apiUrl: window.location.origin
+            };
+            const settings = Object.assign({}, defaults, config);
+            
+            // Create chat widget iframe
+            const iframe = document.createElement('iframe');
+            iframe.id = 'insta-agents-chat';
+            iframe.src = settings.apiUrl + '/widget';
+            iframe.style.cssText = `
+                position: fixed;
+                ${settings.position.includes('bottom') ? 'bottom: 20px' : 'top: 20px'};
+                ${settings.position.includes('right') ? 'right: 20px' : 'left: 20px'};
+                width: 400px;
+                height: 600px;
+                border: none;
+                border-radius: 10px;
+                box-shadow: 0 0 20px rgba(0,0,0,0.1);
+                z-index: 9999;
+                display: none;
+            `;
+            
+            // Create toggle button
+            const button = document.createElement('button');
+            button.id = 'insta-agents-toggle';
+            button.innerHTML = '💬';
+            button.style.cssText = `
+                position: fixed;
+                ${settings.position.includes('bottom') ? 'bottom: 20px' : 'top: 20px'};
+                ${settings.position.includes('right') ? 'right: 20px' : 'left: 20px'};
+                width: 60px;
+                height: 60px;
+                border-radius: 50%;
+                background: #2563eb;
+                color: white;
+                border: none;
+                font-size: 24px;
+                cursor: pointer;
+                box-shadow: 0 4px 12px rgba(0,0,0,0.15);
+                z-index: 9998;
+            `;
+            
+            button.onclick = function() {
+                const isVisible = iframe.style.display === 'block';
+                iframe.style.display = isVisible ? 'none' : 'block';
+                button.style.display = isVisible ? 'block' : 'none';
+            };
+            
+            // Add to page
+            document.body.appendChild(iframe);
+            document.body.appendChild(button);
+            
+            // Message passing
+            window.addEventListener('message', function(event) {
+                if (event.data.type === 'insta-agents-resize') {
+                    iframe.style.height = event.data.height + 'px';
+                }
+            });
+        }
+    };
+})();
@@ -0,0 +1,22 @@
+"""Gunicorn configuration for the Sales Discovery Bot API.
+
+Runs the FastAPI app under uvicorn workers, which use uvloop and
+httptools (installed with uvicorn[standard]) instead of the default
+asyncio loop and h11 parser.
+"""
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# 2 x cores + 1 by default; containers with a CPU limit should set
+# WEB_CONCURRENCY, since cpu_count() reports the host's cores
+workers = int(os.getenv("WEB_CONCURRENCY", max(2, (os.cpu_count() or 1) * 2 + 1)))
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Keep idle client connections open between requests
+keepalive = 5
+
+# LLM calls can take a while; don't kill workers mid-response
+timeout = 120
+graceful_timeout = 30
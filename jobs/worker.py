@@ -10,7 +10,7 @@ import asyncio
 import os
 import signal
 import logging
-from datetime import datetime, timedelta
+from typing import Awaitable, Callable
 
 import redis.asyncio as redis
 from opentelemetry import trace
@@ -29,16 +29,12 @@ class BackgroundWorker:
         self.config = get_config()
         self.redis_client = None
         self.db = None
-        self.running = True
-        
-        # Graceful shutdown
-        signal.signal(signal.SIGTERM, self._handle_shutdown)
-        signal.signal(signal.SIGINT, self._handle_shutdown)
+        self._shutdown_event = asyncio.Event()
     
-    def _handle_shutdown(self, signum, frame):
+    def _handle_shutdown(self, signum):
         """Handle shutdown signals."""
         logger.info(f"Received signal {signum}, shutting down...")
-        self.running = False
+        self._shutdown_event.set()
     
     async def initialize(self):
         """Initialize connections."""
@@ -77,35 +73,49 @@ class BackgroundWorker:
             # Implementation would go here
             pass
     
+    async def _periodic(self, job: Callable[[], Awaitable[None]], interval: float):
+        """Run a job every ``interval`` seconds until shutdown.
+        
+        Sleeps on the shutdown event, so a signal wakes it immediately.
+        Deadlines are fixed multiples of the interval, so job run time
+        doesn't make the schedule drift.
+        """
+        loop = asyncio.get_running_loop()
+        next_run = loop.time() + interval
+        
+        while not self._shutdown_event.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._shutdown_event.wait(),
+                    timeout=max(next_run - loop.time(), 0)
+                )
+                break
+            except asyncio.TimeoutError:
+                pass
+            
+            next_run += interval
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"Worker error: {e}", exc_info=True)
+    
     async def run(self):
         """Main worker loop."""
+        # Graceful shutdown
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self._handle_shutdown, signum)
+        
         await self.initialize()
         
         logger.info("Background worker started")
         
-        last_metrics_run = datetime.utcnow()
-        last_abandoned_check = datetime.utcnow()
-        
-        while self.running:
-            try:
-                now = datetime.utcnow()
-                
-                # Run metrics aggregation hourly
-                if now - last_metrics_run > timedelta(hours=1):
-                    await self.aggregate_metrics()
-                    last_metrics_run = now
-                
-                # Check abandoned conversations every 30 minutes
-                if now - last_abandoned_check > timedelta(minutes=30):
-                    await self.check_abandoned_conversations()
-                    last_abandoned_check = now
-                
-                # Sleep for a bit
-                await asyncio.sleep(60)  # Check every minute
-                
-            except Exception as e:
-                logger.error(f"Worker error: {e}", exc_info=True)
-                await asyncio.sleep(5)  # Brief pause on error
+        await asyncio.gather(
+            # Run metrics aggregation hourly
+            self._periodic(self.aggregate_metrics, 3600),
+            # Check abandoned conversations every 30 minutes
+            self._periodic(self.check_abandoned_conversations, 1800)
+        )
         
         await self.cleanup()
         logger.info("Background worker shutdown complete")
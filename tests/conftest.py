@@ -0,0 +1,23 @@
+"""Shared fixtures for Sales Discovery Bot tests."""
+
+import os
+
+import pytest_asyncio
+import redis.asyncio as redis
+
+
+@pytest_asyncio.fixture(scope="session")
+async def redis_client():
+    """Create one pooled Redis client shared by every test in the session.
+    
+    Tests using it must run on the session event loop.
+    """
+    pool = redis.ConnectionPool.from_url(
+        os.getenv("REDIS_TEST_URL") or os.getenv("REDIS_URL", "redis://localhost:6379"),
+        max_connections=32,
+        health_check_interval=30
+    )
+    client = redis.Redis(connection_pool=pool)
+    yield client
+    await client.aclose()
+    await pool.disconnect()
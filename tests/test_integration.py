@@ -1,47 +1,60 @@
 """Integration tests for Sales Discovery Bot."""
 
 import pytest
+import pytest_asyncio
 import asyncio
 import aiohttp
+import httpx
 from datetime import datetime
 import os
 
-from fastapi.testclient import TestClient
+from asgi_lifespan import LifespanManager
+from prometheus_client import CONTENT_TYPE_LATEST
 from api.main import app
 from api.database import DatabaseManager
 
 
+@pytest.mark.asyncio(scope="class")
 class TestAPIIntegration:
     """Test API endpoints."""
     
-    @pytest.fixture
-    def client(self):
-        """Create test client."""
-        return TestClient(app)
+    @pytest_asyncio.fixture(scope="class")
+    async def client(self):
+        """Create one test client shared by every test in the class.
+        
+        App startup needs live services, so it only runs for integration runs.
+        """
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            if os.getenv("INTEGRATION_TESTS"):
+                async with LifespanManager(app):
+                    yield client
+            else:
+                yield client
     
-    def test_health_endpoint(self, client):
+    async def test_health_endpoint(self, client):
         """Test health check endpoint."""
-        response = client.get("/health")
+        response = await client.get("/health")
         assert response.status_code == 200
         data = response.json()
         assert "status" in data
         assert "timestamp" in data
         assert "version" in data
     
-    def test_metrics_endpoint(self, client):
+    async def test_metrics_endpoint(self, client):
         """Test Prometheus metrics endpoint."""
-        response = client.get("/metrics")
+        response = await client.get("/metrics")
         assert response.status_code == 200
-        assert response.headers["content-type"] == "text/plain; charset=utf-8"
+        assert response.headers["content-type"] == CONTENT_TYPE_LATEST
         assert "conversations_started_total" in response.text
     
     @pytest.mark.skipif(
         not os.getenv("INTEGRATION_TESTS"),
         reason="Integration tests require live services"
     )
-    def test_chat_endpoint(self, client):
+    async def test_chat_endpoint(self, client):
         """Test chat endpoint with real services."""
-        response = client.post("/chat", json={
+        response = await client.post("/chat", json={
             "message": "I run a software company with 10 employees",
             "source": "api"
         })
@@ -52,16 +65,36 @@ class TestAPIIntegration:
         assert "response" in data
         assert data["stage"] is not None
     
-    def test_widget_js(self, client):
+    async def test_cors_scoped_to_api(self, client):
+        """Test CORS only covers API routes and rejects unlisted origins."""
+        headers = {"Origin": "https://unlisted.example"}
+        
+        # The CORS middleware runs, but doesn't allow an unlisted origin
+        response = await client.get("/conversations", headers=headers)
+        assert "access-control-allow-credentials" in response.headers
+        assert "access-control-allow-origin" not in response.headers
+        
+        response = await client.get("/widget.js", headers=headers)
+        assert "access-control-allow-credentials" not in response.headers
+    
+    async def test_widget_js(self, client):
         """Test widget JavaScript delivery."""
-        response = client.get("/widget.js")
+        response = await client.get("/widget.js")
         assert response.status_code == 200
         assert response.headers["content-type"] == "application/javascript"
         assert "InstaAgentsChat" in response.text
     
-    def test_widget_html(self, client):
+    async def test_widget_js_not_modified(self, client):
+        """Test widget revalidation with a matching ETag."""
+        etag = (await client.get("/widget.js")).headers["etag"]
+        
+        response = await client.get("/widget.js", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+    
+    async def test_widget_html(self, client):
         """Test widget HTML interface."""
-        response = client.get("/widget")
+        response = await client.get("/widget")
         assert response.status_code == 200
         assert response.headers["content-type"] == "text/html; charset=utf-8"
         assert "Insta Agents Chat" in response.text
@@ -70,7 +103,7 @@ class TestAPIIntegration:
 class TestDatabaseIntegration:
     """Test database operations."""
     
-    @pytest.fixture
+    @pytest_asyncio.fixture
     async def db_manager(self):
         """Create test database manager."""
         if not os.getenv("POSTGRES_TEST_DSN"):
@@ -114,6 +147,111 @@ class TestDatabaseIntegration:
         assert messages[1]["role"] == "ai"
         assert messages[1]["content"] == "Hi there!"
     
+    @pytest.mark.asyncio
+    async def test_add_messages_bulk(self, db_manager):
+        """Test adding a turn's messages in one call, after earlier ones."""
+        conv_id = "test-conv-" + str(datetime.utcnow().timestamp())
+        await db_manager.create_conversation(conv_id, "test")
+        await db_manager.add_message(conv_id, "ai", "Welcome!")
+        
+        await db_manager.add_messages_bulk([
+            (conv_id, "human", "Hello"),
+            (conv_id, "ai", "Hi there!")
+        ])
+        
+        messages = await db_manager.get_messages(conv_id)
+        
+        assert [m["role"] for m in messages] == ["ai", "human", "ai"]
+        assert [m["content"] for m in messages] == ["Welcome!", "Hello", "Hi there!"]
+    
+    @pytest.mark.asyncio
+    async def test_commit_chat_turn(self, db_manager):
+        """Test persisting a whole chat turn in one transaction."""
+        conv_id = "test-conv-" + str(datetime.utcnow().timestamp())
+        
+        created = await db_manager.commit_chat_turn(
+            conversation_id=conv_id,
+            source="api",
+            human_message="Hello",
+            ai_message="Hi there!",
+            state={"stage": "understand"}
+        )
+        assert created is True
+        
+        conv = await db_manager.get_conversation(conv_id)
+        assert conv["source"] == "api"
+        assert conv["state"]["stage"] == "understand"
+        
+        messages = await db_manager.get_messages(conv_id)
+        assert [m["role"] for m in messages] == ["human", "ai"]
+        assert messages[1]["content"] == "Hi there!"
+        
+        created = await db_manager.commit_chat_turn(
+            conversation_id=conv_id,
+            source="api",
+            human_message="Thanks",
+            ai_message="Anytime!",
+            state={}
+        )
+        assert created is False
+    
+    @pytest.mark.asyncio
+    async def test_commit_chat_turn_with_lead(self, db_manager):
+        """Test a booking turn upserts its lead in the same transaction."""
+        conv_id = "test-conv-" + str(datetime.utcnow().timestamp())
+        lead = {
+            "mvp_proposal": {"agent_name": "Lead Tracker"},
+            "partnership_tier": "starter"
+        }
+        
+        created = await db_manager.commit_chat_turn(
+            conversation_id=conv_id,
+            source="api",
+            human_message="Let's book",
+            ai_message="Here's the link!",
+            state={"business_info": {"business_type": "Test Company"}},
+            lead=lead
+        )
+        assert created is True
+        
+        # A repeat booking turn updates the same lead
+        await db_manager.commit_chat_turn(
+            conversation_id=conv_id,
+            source="api",
+            human_message="Booked",
+            ai_message="See you then!",
+            state={},
+            lead={**lead, "partnership_tier": "growth"}
+        )
+        
+        async with db_manager.pool.acquire() as conn:
+            leads = await conn.fetch(
+                "SELECT * FROM leads WHERE conversation_id = $1", conv_id
+            )
+        assert len(leads) == 1
+        assert leads[0]["business_name"] == "Test Company"
+        assert leads[0]["proposed_mvp"] == {"agent_name": "Lead Tracker"}
+        assert leads[0]["partnership_tier"] == "growth"
+        
+        messages = await db_manager.get_messages(conv_id)
+        assert len(messages) == 4
+    
+    @pytest.mark.asyncio
+    async def test_get_conversation_with_messages(self, db_manager):
+        """Test reading a conversation and its messages in one query."""
+        conv_id = "test-conv-" + str(datetime.utcnow().timestamp())
+        await db_manager.create_conversation(conv_id, "test")
+        await db_manager.add_messages_bulk([
+            (conv_id, "human", "Hello"),
+            (conv_id, "ai", "Hi there!")
+        ])
+        
+        conversation = await db_manager.get_conversation_with_messages(conv_id)
+        
+        assert conversation["source"] == "test"
+        assert [m["content"] for m in conversation["messages"]] == ["Hello", "Hi there!"]
+        assert await db_manager.get_conversation_with_messages("missing") is None
+    
     @pytest.mark.asyncio
     async def test_update_conversation_state(self, db_manager):
         """Test updating conversation state."""
@@ -131,6 +269,13 @@ class TestDatabaseIntegration:
         conversation = await db_manager.get_conversation(conv_id)
         assert conversation["state"]["stage"] == "propose"
         assert conversation["state"]["calendly_shown"] is True
+        
+        # Later updates only carry the changed keys
+        await db_manager.update_conversation_state(conv_id, {"stage": "complete"})
+        
+        conversation = await db_manager.get_conversation(conv_id)
+        assert conversation["state"]["stage"] == "complete"
+        assert conversation["state"]["mvp_proposal"] == {"agent_name": "Test Agent"}
     
     @pytest.mark.asyncio
     async def test_create_lead(self, db_manager):
@@ -155,6 +300,20 @@ class TestDatabaseIntegration:
         assert lead["conversation_id"] == conv_id
         assert lead["business_name"] == "Test Company"
         assert lead["partnership_tier"] == "starter"
+    
+    @pytest.mark.asyncio
+    async def test_estimate_conversation_count_by_source(self, db_manager):
+        """Test a source filter gets its own count estimate."""
+        conv_id = "test-conv-" + str(datetime.utcnow().timestamp())
+        await db_manager.create_conversation(conv_id, "test")
+        async with db_manager.pool.acquire() as conn:
+            await conn.execute("ANALYZE conversations")
+        
+        total = await db_manager.estimate_conversation_count()
+        by_source = await db_manager.estimate_conversation_count("test")
+        
+        assert 1 <= by_source <= max(total, 1)
+        assert set(db_manager._count_estimates) == {None, "test"}
 
 
 class TestRedisIntegration:
@@ -164,12 +323,11 @@ class TestRedisIntegration:
         not os.getenv("REDIS_TEST_URL"),
         reason="Redis tests require REDIS_TEST_URL"
     )
-    @pytest.mark.asyncio
-    async def test_redis_connectivity(self):
+    @pytest.mark.xdist_group(name="redis")
+    @pytest.mark.asyncio(scope="session")
+    async def test_redis_connectivity(self, redis_client):
         """Test Redis connection and basic operations."""
-        import redis.asyncio as redis
-        
-        client = redis.from_url(os.getenv("REDIS_TEST_URL"))
+        client = redis_client
         
         # Test ping
         pong = await client.ping()
@@ -181,5 +339,4 @@ class TestRedisIntegration:
         assert value == b"test_value"
         
         # Cleanup
-        await client.delete("test:key")
-        await client.close()
\ No newline at end of file
+        await client.delete("test:key")
\ No newline at end of file